@@ -10,6 +10,9 @@ Observações:
 - Formatação numérica em estilo BR: ponto para milhar e vírgula para decimais.
 """
 
+import functools
+import math
+
 import streamlit as st
 import numpy as np
 import pandas as pd
@@ -18,15 +21,17 @@ import altair as alt
 # -----------------------------
 # Helpers: formatação (BR) e financeiras
 # -----------------------------
+# limite por função cacheada: cada submissão distinta guarda seus DataFrames em memória
+CACHE_MAX_ENTRIES = 64
+
+# troca separadores em um único passe: 1,234,567.89 -> 1.234.567,89
+_BR_TRANS = str.maketrans({",": ".", ".": ","})
+
 def br_currency(x):
     """Formata número em real no padrão BR: 1.234.567,89"""
-    try:
-        s = f"{x:,.2f}"
-        # troca separadores: 1,234,567.89 -> 1.234.567,89
-        s = s.replace(",", "X").replace(".", ",").replace("X", ".")
-        return f"R$ {s}"
-    except Exception:
-        return f"R$ {x}"
+    if isinstance(x, (int, float, np.integer, np.floating)) and math.isfinite(x):
+        return "R$ " + format(x, ",.2f").translate(_BR_TRANS)
+    return f"R$ {x}"
 
 def br_percent(x, decimals=2):
     """Formata número percentual (x em %) como '12,34%'"""
@@ -37,8 +42,8 @@ def br_percent(x, decimals=2):
     except Exception:
         return f"{x}%"
 
-def annuity_payment(principal: float, monthly_rate: float, months: int) -> float:
-    """Parcela mensal pelo sistema PRICE (anuidade)."""
+@functools.lru_cache(maxsize=256)
+def _annuity_payment(principal: float, monthly_rate: float, months: int) -> float:
     if months == 0:
         return 0.0
     if monthly_rate == 0:
@@ -47,6 +52,11 @@ def annuity_payment(principal: float, monthly_rate: float, months: int) -> float
     payment = r * principal / (1 - (1 + r) ** (-months))
     return payment
 
+def annuity_payment(principal: float, monthly_rate: float, months: int) -> float:
+    """Parcela mensal pelo sistema PRICE (anuidade)."""
+    return _annuity_payment(float(principal), float(monthly_rate), int(months))
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
 def financing_amortization_schedule(
     property_value: float,
     down_payment: float,
@@ -67,47 +77,47 @@ def financing_amortization_schedule(
 
     upfront_fee = other_upfront_fees_pct / 100.0 * financed_amount
 
-    # construir linhas
-    rows = []
+    # saldo devedor em forma fechada (PRICE): B_m = P(1+r)^m - PMT((1+r)^m - 1)/r
+    # obs.: vale enquanto seguro/taxas não alteram a parcela PRICE; regras que dependam
+    # do saldo mês a mês (ex.: faixas de seguro) exigem laço sobre vetores pré-alocados.
+    m = np.arange(months + 1, dtype=np.int32)
+    if monthly_interest == 0:
+        balance = financed_amount - payment * m
+    else:
+        pow_r = (1 + monthly_interest) ** m
+        balance = financed_amount * pow_r - payment * (pow_r - 1) / monthly_interest
+    balance = np.maximum(balance, 0.0)
+    balance[0] = financed_amount
+
+    saldo_inicial = np.concatenate(([financed_amount], balance[:-1]))
+    saldo_final = balance
+    juros = monthly_interest * saldo_inicial
+    amortizacao = payment - juros
+    # seguro como % anual sobre saldo inicial financiado (aprox. simplificação)
+    seguro = np.full(months + 1, insurance_annual_pct / 100.0 / 12.0 * financed_amount)
+    outras_taxas = other_monthly_fees_pct_on_balance / 100.0 / 12.0 * saldo_inicial
+    parcela = payment + seguro + outras_taxas
+
     # t=0 desembolso (entrada + upfront fee) - representado como pagamento (positivo = saída)
-    rows.append({
-        "month": 0,
-        "saldo_inicial": financed_amount,
-        "juros": 0.0,
-        "amortizacao": 0.0,
-        "seguro": 0.0,
-        "outras_taxas": upfront_fee,
-        "parcela": down_payment + upfront_fee,
-        "saldo_final": financed_amount
+    juros[0] = 0.0
+    amortizacao[0] = 0.0
+    seguro[0] = 0.0
+    outras_taxas[0] = upfront_fee
+    parcela[0] = down_payment + upfront_fee
+
+    df = pd.DataFrame({
+        "month": m,
+        "saldo_inicial": saldo_inicial,
+        "juros": juros,
+        "amortizacao": amortizacao,
+        "seguro": seguro,
+        "outras_taxas": outras_taxas,
+        "parcela": parcela,
+        "saldo_final": saldo_final
     })
-
-    balance = financed_amount
-    for m in range(1, months + 1):
-        interest_comp = monthly_interest * balance
-        amort = payment - interest_comp
-        # atualiza saldo
-        saldo_final = max(balance - amort, 0.0)
-        # seguro como % anual sobre saldo inicial financiado (aprox. simplificação)
-        seguro_mensal = insurance_annual_pct / 100.0 / 12.0 * financed_amount
-        outras_taxas_mensais = other_monthly_fees_pct_on_balance / 100.0 / 12.0 * balance
-        parcela_total = payment + seguro_mensal + outras_taxas_mensais
-
-        rows.append({
-            "month": m,
-            "saldo_inicial": balance,
-            "juros": interest_comp,
-            "amortizacao": amort,
-            "seguro": seguro_mensal,
-            "outras_taxas": outras_taxas_mensais,
-            "parcela": parcela_total,
-            "saldo_final": saldo_final
-        })
-
-        balance = saldo_final
-
-    df = pd.DataFrame(rows)
     return df
 
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
 def compute_consorcio_cashflows(
     credit_value: float,
     months: int,
@@ -125,47 +135,130 @@ def compute_consorcio_cashflows(
     admin_monthly = admin_annual_pct / 100.0 / 12.0 * credit_value
     reserve_monthly = reserve_monthly_pct / 100.0 * credit_value
 
-    rows = []
-    rows.append({
-        "month": 0,
-        "amortizacao": 0.0,
-        "admin": 0.0,
-        "reserva": initial_bid_payment,
-        "parcela": initial_bid_payment
+    amortizacao = np.full(months + 1, parcel_base)
+    admin = np.full(months + 1, admin_monthly)
+    reserva = np.full(months + 1, reserve_monthly)
+    # t=0: apenas o lance/entrada
+    amortizacao[0] = 0.0
+    admin[0] = 0.0
+    reserva[0] = initial_bid_payment
+    parcela = amortizacao + admin + reserva
+
+    df = pd.DataFrame({
+        "month": np.arange(months + 1, dtype=np.int32),
+        "amortizacao": amortizacao,
+        "admin": admin,
+        "reserva": reserva,
+        "parcela": parcela
     })
-    for m in range(1, months + 1):
-        parcela_total = parcel_base + admin_monthly + reserve_monthly
-        rows.append({
-            "month": m,
-            "amortizacao": parcel_base,
-            "admin": admin_monthly,
-            "reserva": reserve_monthly,
-            "parcela": parcela_total
-        })
-    df = pd.DataFrame(rows)
     return df
 
-def monthly_irr_from_cashflows(cashflows: pd.Series):
-    try:
-        rate = np.irr(cashflows.values)
-        return rate
-    except Exception:
+def _npv_at(cf: np.ndarray, i: np.ndarray, rate: float) -> float:
+    return float(cf @ ((1 + rate) ** -i))
+
+def irr_newton(cf: np.ndarray, guess: float = 0.01, tol: float = 1e-9, max_iter: int = 50) -> float:
+    """
+    TIR por Newton-Raphson sobre o VPL (derivada analítica).
+    Se Newton não convergir, recorre à bisseção; o limite inferior se aproxima de -100%
+    ao mês até encontrar troca de sinal.
+    Retorna nan quando não há troca de sinal (TIR inexistente).
+    """
+    # expoentes e i*cf montados uma vez por solução; o vetor de desconto de cada
+    # iteração serve tanto ao VPL quanto à derivada
+    i = np.arange(cf.size)
+    icf = i * cf
+    r = float(guess)
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            disc = (1 + r) ** -i
+            f = cf @ disc
+            fprime = -(icf @ disc) / (1 + r)
+            if fprime == 0 or not np.isfinite(fprime):
+                break
+            step = f / fprime
+            r -= step
+            if not np.isfinite(r) or r <= -1:
+                break
+            if abs(step) < tol:
+                return float(r)
+
+    # fallback: bisseção (busca o intervalo; perto de -100% o VPL pode estourar p/ prazos longos)
+    hi = 1.0
+    with np.errstate(over="ignore", invalid="ignore"):
+        f_hi = _npv_at(cf, i, hi)
+        for lo in (-0.5, -0.9, -0.99, -0.999):
+            f_lo = _npv_at(cf, i, lo)
+            if not np.isfinite(f_lo):
+                return np.nan
+            if np.sign(f_lo) != np.sign(f_hi):
+                break
+        else:
+            return np.nan
+        for _ in range(200):
+            mid = 0.5 * (lo + hi)
+            f_mid = _npv_at(cf, i, mid)
+            if np.sign(f_mid) == np.sign(f_lo):
+                lo, f_lo = mid, f_mid
+            else:
+                hi = mid
+            if hi - lo < tol:
+                break
+    return 0.5 * (lo + hi)
+
+def monthly_irr_from_cashflows(cashflows: np.ndarray):
+    cf = np.ascontiguousarray(cashflows, dtype=np.float64)
+    if cf.size < 2:
         return np.nan
+    return irr_newton(cf)
 
 def to_annual_from_monthly(monthly_rate):
     if monthly_rate is None or np.isnan(monthly_rate):
         return np.nan
     return (1 + monthly_rate) ** 12 - 1
 
-def compute_vpl(cashflows: pd.Series, annual_discount_pct: float):
+def compute_vpl(cashflows: np.ndarray, annual_discount_pct: float):
     monthly_discount = (1 + annual_discount_pct / 100.0) ** (1/12) - 1
-    vpl = sum(cf / ((1 + monthly_discount) ** i) for i, cf in enumerate(cashflows))
+    cf = np.asarray(cashflows, dtype=np.float64)
+    discounts = (1 + monthly_discount) ** np.arange(cf.size)
+    vpl = float((cf / discounts).sum())
     return vpl
 
-def required_capital_to_cover_payment(monthly_payment: float, monthly_return_pct: float):
-    if monthly_return_pct <= 0:
-        return np.nan
-    return monthly_payment / monthly_return_pct
+def required_capital_to_cover_payment(monthly_payment, monthly_return_pct):
+    """
+    Capital cujo rendimento mensal cobre a parcela (nan para rendimento <= 0).
+    Aceita escalares ou arrays (ex.: varredura de taxas); escalares retornam float.
+    """
+    pay = np.asarray(monthly_payment, dtype=np.float64)
+    r = np.asarray(monthly_return_pct, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        capital = np.where(r > 0, pay / r, np.nan)
+    return capital.item() if capital.ndim == 0 else capital
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def build_plot_df(df_amort: pd.DataFrame, df_cons: pd.DataFrame) -> pd.DataFrame:
+    """Parcelas mensais (e acumuladas) dos dois cenários lado a lado (0 onde o prazo já terminou)."""
+    # meses são contíguos 0..N em ambos: atribuição direta em vetores zerados
+    n = max(len(df_amort), len(df_cons))
+    parcela_fin = np.zeros(n)
+    parcela_fin[:len(df_amort)] = df_amort["parcela"].to_numpy()
+    parcela_cons = np.zeros(n)
+    parcela_cons[:len(df_cons)] = df_cons["parcela"].to_numpy()
+    plot_df = pd.DataFrame({
+        "month": np.arange(n, dtype=np.int32),
+        "parcela_fin": parcela_fin,
+        "parcela_cons": parcela_cons
+    })
+    plot_df["cum_fin"] = plot_df["parcela_fin"].cumsum()
+    plot_df["cum_cons"] = plot_df["parcela_cons"].cumsum()
+    # parcelas mensais em float32 (erro < R$ 0,001 nos valores típicos) reduzem o JSON do Altair;
+    # acumulados ficam em float64: acima de ~R$ 131 mil o espaçamento do float32 passa de 1 centavo
+    plot_df[["parcela_fin", "parcela_cons"]] = plot_df[["parcela_fin", "parcela_cons"]].astype(np.float32)
+    return plot_df
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV (utf-8) para download; em cache para não reserializar a cada rerun."""
+    return df.to_csv(index=False).encode("utf-8")
 
 # -----------------------------
 # Streamlit UI
@@ -230,10 +323,9 @@ df_amort = financing_amortization_schedule(
     other_monthly_fees_pct_on_balance=float(fin_monthly_fee_pct)
 )
 
-# Fluxos financeiros do financiamento (serie de cashflows: t=0..N onde negativo = saída)
-# Para IRR/VPL, modelamos chegadas do ponto de vista do cliente (saídas positivas => representadas como negativos)
-flows_fin = [-row for row in df_amort["parcela"].values]  # parcelas (t=0..N) como saídas -> negativos para TIR
-# Note: t=0 included as parcela with entry+upfront
+# Fluxos de pagamento do financiamento (t=0..N, negativo = saída), usados no VPL;
+# t=0 = entrada + taxas upfront. Os fluxos do CET são montados abaixo.
+flows_fin = -df_amort["parcela"].to_numpy()
 
 # Consórcio
 df_cons = compute_consorcio_cashflows(
@@ -243,21 +335,27 @@ df_cons = compute_consorcio_cashflows(
     reserve_monthly_pct=float(cons_reserve_monthly_pct),
     initial_bid_payment=float(cons_initial_bid)
 )
-flows_cons = [-row for row in df_cons["parcela"].values]
-
-# CET via IRR
-irr_fin_monthly = monthly_irr_from_cashflows(pd.Series(flows_fin))
-irr_cons_monthly = monthly_irr_from_cashflows(pd.Series(flows_cons))
+flows_cons = -df_cons["parcela"].to_numpy()
+
+# CET via IRR: em t=0 o cliente recebe o crédito (valor financiado / carta do consórcio,
+# assumida contemplada já em t=0) e paga taxas upfront/lance; a entrada do imóvel não
+# integra o CET. Sem essa entrada de caixa não há troca de sinal e a TIR não existe.
+cet_flows_fin = flows_fin.copy()
+cet_flows_fin[0] = df_amort["saldo_inicial"].iat[0] - df_amort["outras_taxas"].iat[0]
+cet_flows_cons = flows_cons.copy()
+cet_flows_cons[0] = cons_credit_value - float(cons_initial_bid)
+irr_fin_monthly = monthly_irr_from_cashflows(cet_flows_fin)
+irr_cons_monthly = monthly_irr_from_cashflows(cet_flows_cons)
 cet_fin_annual = to_annual_from_monthly(irr_fin_monthly)
 cet_cons_annual = to_annual_from_monthly(irr_cons_monthly)
 
-# parcelas médias (sem considerar t=0 entrada)
-avg_parcel_fin = df_amort.loc[df_amort["month"] != 0, "parcela"].mean()
-avg_parcel_cons = df_cons.loc[df_cons["month"] != 0, "parcela"].mean()
+# parcelas médias (sem considerar t=0 entrada; month == 0 é sempre a primeira linha)
+avg_parcel_fin = df_amort["parcela"].to_numpy()[1:].mean()
+avg_parcel_cons = df_cons["parcela"].to_numpy()[1:].mean()
 
 # VPL com taxa de desconto informada (entrada em percentual anual)
-vpl_fin = compute_vpl(pd.Series(flows_fin), annual_discount_rate)
-vpl_cons = compute_vpl(pd.Series(flows_cons), annual_discount_rate)
+vpl_fin = compute_vpl(flows_fin, annual_discount_rate)
+vpl_cons = compute_vpl(flows_cons, annual_discount_rate)
 
 # capital necessário para cobrir parcela pela taxa de rendimento mensal indicada
 monthly_return_frac = monthly_return_pct_input / 100.0
@@ -306,22 +404,20 @@ st.markdown("---")
 # -----------------------------
 st.subheader("Tabela de Amortização (Financiamento)")
 # mostra primeira e últimas linhas, com formato
+AMORT_CURRENCY_COLS = ["saldo_inicial", "juros", "amortizacao", "seguro", "outras_taxas", "parcela", "saldo_final"]
+
 def df_amort_formatted(df):
-    df2 = df.copy()
-    df2["saldo_inicial"] = df2["saldo_inicial"].apply(br_currency)
-    df2["juros"] = df2["juros"].apply(br_currency)
-    df2["amortizacao"] = df2["amortizacao"].apply(br_currency)
-    df2["seguro"] = df2["seguro"].apply(br_currency)
-    df2["outras_taxas"] = df2["outras_taxas"].apply(br_currency)
-    df2["parcela"] = df2["parcela"].apply(br_currency)
-    df2["saldo_final"] = df2["saldo_final"].apply(br_currency)
+    """Formata (em um único passe) as colunas monetárias das linhas recebidas."""
+    formatted = np.vectorize(br_currency, otypes=[object])(df[AMORT_CURRENCY_COLS].to_numpy())
+    df2 = pd.DataFrame(formatted, columns=AMORT_CURRENCY_COLS, index=df.index)
+    df2.insert(0, "month", df["month"].to_numpy())
     return df2
 
 st.dataframe(df_amort_formatted(df_amort.head(10)), height=300)
 st.markdown("...")
 st.dataframe(df_amort_formatted(df_amort.tail(6)), height=200)
 
-csv_amort = df_amort.to_csv(index=False).encode("utf-8")
+csv_amort = _df_to_csv_bytes(df_amort)
 st.download_button("📥 Baixar tabela de amortização (Financiamento) - CSV", csv_amort, file_name="amortizacao_financiamento.csv", mime="text/csv")
 
 # -----------------------------
@@ -345,8 +441,8 @@ with c2:
     st.markdown("**Consórcio — primeiros 6 meses**")
     st.table(df_cons_flow_sample.rename(columns={"month":"Mês","parcela":"Parcela (R$)"}))
 
-csv_fin = pd.DataFrame({"month": df_amort["month"], "parcela": df_amort["parcela"]}).to_csv(index=False).encode("utf-8")
-csv_cons = df_cons.to_csv(index=False).encode("utf-8")
+csv_fin = _df_to_csv_bytes(df_amort[["month", "parcela"]])
+csv_cons = _df_to_csv_bytes(df_cons)
 st.download_button("📥 Baixar fluxo completo - Financiamento (CSV)", csv_fin, file_name="fluxo_financiamento.csv", mime="text/csv")
 st.download_button("📥 Baixar fluxo completo - Consórcio (CSV)", csv_cons, file_name="fluxo_consorcio.csv", mime="text/csv")
 
@@ -358,19 +454,7 @@ st.markdown("---")
 st.subheader("Gráficos — comparação visual dos fluxos e componentes")
 
 # preparar df para gráficos
-max_months = max(int(fin_months), int(cons_months))
-months = list(range(0, max_months + 1))
-plot_df = pd.DataFrame({"month": months})
-
-# financiar: merge parcelas (preencher 0 onde não existe)
-df_fin_plot = pd.DataFrame({"month": df_amort["month"], "parcela_fin": df_amort["parcela"]})
-plot_df = plot_df.merge(df_fin_plot, on="month", how="left")
-plot_df["parcela_fin"].fillna(0.0, inplace=True)
-
-# consorcio
-df_cons_plot = pd.DataFrame({"month": df_cons["month"], "parcela_cons": df_cons["parcela"]})
-plot_df = plot_df.merge(df_cons_plot, on="month", how="left")
-plot_df["parcela_cons"].fillna(0.0, inplace=True)
+plot_df = build_plot_df(df_amort, df_cons)
 
 # transformar para long form para linhas
 df_long = plot_df.melt(id_vars="month", value_vars=["parcela_fin","parcela_cons"],
@@ -378,7 +462,9 @@ df_long = plot_df.melt(id_vars="month", value_vars=["parcela_fin","parcela_cons"
 df_long["scenario"] = df_long["scenario"].map({"parcela_fin":"Financiamento", "parcela_cons":"Consórcio"})
 
 if show_monthly_chart:
-    line = alt.Chart(df_long[df_long["month"]>0]).mark_line(point=True).encode(
+    # prazos longos: centenas de marcadores pesam no navegador; mantém só a linha
+    max_months = max(int(fin_months), int(cons_months))
+    line = alt.Chart(df_long[df_long["month"]>0]).mark_line(point=max_months <= 120).encode(
         x=alt.X("month:Q", title="Mês"),
         y=alt.Y("parcela:Q", title="Pagamento mensal (R$)"),
         color="scenario:N",
@@ -389,29 +475,33 @@ else:
     st.info("Ative o gráfico mensal para visualização.")
 
 # Gráfico 2: pagamentos cumulados
-plot_df["cum_fin"] = plot_df["parcela_fin"].cumsum()
-plot_df["cum_cons"] = plot_df["parcela_cons"].cumsum()
-cum_long = plot_df.melt(id_vars="month", value_vars=["cum_fin","cum_cons"], var_name="scenario", value_name="cum_payment")
-cum_long["scenario"] = cum_long["scenario"].map({"cum_fin":"Financiamento","cum_cons":"Consórcio"})
-
-area = alt.Chart(cum_long[cum_long["month"]>0]).mark_area(opacity=0.3).encode(
+# fold (wide -> long) feito no cliente pelo Vega, sem materializar o melt aqui
+cum_df = plot_df.loc[plot_df["month"]>0, ["month","cum_fin","cum_cons"]]
+area = alt.Chart(cum_df).transform_fold(
+    ["cum_fin", "cum_cons"],
+    as_=["scenario", "cum_payment"]
+).transform_calculate(
+    scenario="datum.scenario == 'cum_fin' ? 'Financiamento' : 'Consórcio'"
+).mark_area(opacity=0.3).encode(
     x="month:Q",
     y=alt.Y("cum_payment:Q", title="Pagamento acumulado (R$)"),
     color="scenario:N",
-    tooltip=["month","scenario","cum_payment"]
+    tooltip=["month:Q","scenario:N","cum_payment:Q"]
 ).properties(width=900, height=300)
 st.altair_chart(area, use_container_width=True)
 
 # Gráfico 3: componentes do financiamento (juros x amortização x seguro x outras)
-comp_df = df_amort.copy()
-comp_df = comp_df.loc[comp_df["month"]>0, ["month","juros","amortizacao","seguro","outras_taxas"]]
-# melt para stacked area
-comp_long = comp_df.melt(id_vars="month", var_name="component", value_name="value")
-stack = alt.Chart(comp_long).mark_area(opacity=0.6).encode(
+comp_df = df_amort.loc[df_amort["month"]>0, ["month","juros","amortizacao","seguro","outras_taxas"]]
+comp_df = comp_df.astype({c: np.float32 for c in ["juros","amortizacao","seguro","outras_taxas"]})
+# fold para stacked area (no cliente)
+stack = alt.Chart(comp_df).transform_fold(
+    ["juros", "amortizacao", "seguro", "outras_taxas"],
+    as_=["component", "value"]
+).mark_area(opacity=0.6).encode(
     x="month:Q",
     y=alt.Y("value:Q", title="Valor (R$)"),
     color="component:N",
-    tooltip=["month","component","value"]
+    tooltip=["month:Q","component:N","value:Q"]
 ).properties(width=900, height=320)
 st.markdown("Componentes do pagamento (Financiamento): juros, amortização (principal), seguro e outras taxas.")
 st.altair_chart(stack, use_container_width=True)